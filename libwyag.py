@@ -1,15 +1,28 @@
 import argparse
 import collections
-import configparser
-from datetime import datetime
-import grp, pwd
-from fnmatch import fnmatch
+import functools
 import hashlib
-from math import ceil
+import mmap
 import os
 import re
+import stat
 import sys
-import zlib
+import threading
+
+# Modules only some commands need (configparser, concurrent.futures,
+# tempfile) are imported where they're used: importing all of them here
+# would slow down the startup of every command.
+
+# Intel's ISA-L and zlib-ng implement DEFLATE with SIMD and are drop-in
+# replacements for zlib, several times faster on x86-64 for ISA-L: use
+# one of them when it's installed (see README.md).
+try:
+    from isal import isal_zlib as zlib
+except ImportError:
+    try:
+        from zlib_ng import zlib_ng as zlib
+    except ImportError:
+        import zlib
 
 
 argparser = argparse.ArgumentParser(description="Version control")
@@ -52,9 +65,9 @@ argsp.add_argument(
     help="Specify the type",
 )
 argsp.add_argument(
-    "-w", dest="write", action="store_value", help="Write the object into the database"
+    "-w", dest="write", action="store_true", help="Write the object into the database"
 )
-argsp.add_argument("path", help="Read object from <file>")
+argsp.add_argument("path", nargs="+", help="Read object from <file>")
 
 # Log subparser
 argsp = argsubparsers.add_parser("log", help="Display history of a given commit.")
@@ -97,69 +110,89 @@ argsp.add_argument(
 # From the first one, so we skip the "wyag" command
 def main(argv=sys.argv[1:]):
     args = argparser.parse_args(argv)
-    match args.command:
-        case "add":
-            cmd_add(args)
-        case "cat-file":
-            cmd_cat_file(args)
-        case "check-ignore":
-            cmd_check_ignore(args)
-        case "checkout":
-            cmd_checkout(args)
-        case "commit":
-            cmd_commit(args)
-        case "hash-object":
-            cmd_hash_object(args)
-        case "init":
-            cmd_init(args)
-        case "log":
-            cmd_log(args)
-        case "ls-files":
-            cmd_ls_files(args)
-        case "ls-tree":
-            cmd_ls_tree(args)
-        case "rev-parse":
-            cmd_rev_parse(args)
-        case "rm":
-            cmd_rm(args)
-        case "show-ref":
-            cmd_show_ref(args)
-        case "status":
-            cmd_status(args)
-        case "tag":
-            cmd_tag(args)
-        case _:
-            print("Bad command.")
+    # Each command is handled by the cmd_* function of the same name: a
+    # single dict lookup, instead of comparing the name to every command.
+    cmd = globals().get("cmd_" + args.command.replace("-", "_"))
+    if cmd is None:
+        print("Bad command.")
+    else:
+        cmd(args)
+
+
+# ConfigParser is slow to set up and parse with (lots of regexes and dicts),
+# all for reading a handful of keys: .git/config is read with this minimal
+# parser instead.  Files are still written with ConfigParser, see
+# repo_default_config.
+class GitConfig(object):
+    def __init__(self) -> None:
+        self.sections = dict()
+
+    def read(self, path: str) -> None:
+        section = None
+        with open(path, "r") as f:
+            for line in f:
+                line = line.strip()
+
+                # Skip blank lines and comments
+                if not line or line[0] in "#;":
+                    continue
+
+                if line[0] == "[" and line[-1] == "]":
+                    section = self.sections.setdefault(line[1:-1].strip(), dict())
+                    continue
+
+                if section is None:
+                    raise Exception("Key outside of any section in %s" % path)
+
+                # Keys are case-insensitive, like ConfigParser does
+                key, _, value = line.partition("=")
+                section[key.strip().lower()] = value.strip()
+
+    def get(self, section: str, key: str) -> str:
+        return self.sections[section][key.lower()]
 
 
 class GitRepository(object):
     worktree = None
     gitdir = None
-    conf = None
 
     def __init__(self, path, force=False) -> None:
         self.worktree = path
         self.gitdir = os.path.join(path, ".git")
+        self.objects_dir = os.path.join(self.gitdir, "objects")
+        # Object shards known to exist, see _objects_shard
+        self._ensured_shards = set()
+        self._ensured_shards_lock = threading.Lock()
+        self._force = force
 
         if not (force or os.path.isdir(self.gitdir)):
             raise Exception("This is not a Git repository %s" % path)
 
+    # Read and validated only once, on first access: repo_find does so as
+    # soon as it finds a repository, before any object is read or written.
+    @functools.cached_property
+    def conf(self) -> GitConfig:
         # Read configuration file in .git/config
-        self.conf = configparser.ConfigParser()
+        conf = GitConfig()
         config = repo_file(self, "config")
 
         if config and os.path.exists(config):
-            self.conf.read(config)
-        elif not force:
+            conf.read(config)
+        elif not self._force:
             raise Exception("Configuration file missing")
 
-        if not force:
-            version = int(self.conf.get("core", "repositoryformatversion"))
+        if not self._force:
+            version = int(conf.get("core", "repositoryformatversion"))
             if version != 0:
                 raise Exception("Unsupported repositoryformatversion %s" % version)
 
+        return conf
+
 
 class GitObject(object):
+    # fmt is a class attribute; subclasses only slot the state they carry.
+    __slots__ = ()
+
     def __init__(self, data=None) -> None:
         if data != None:
             self.deserialize(data)
@@ -177,6 +210,7 @@ class GitObject(object):
 
 
 class GitBlob(GitObject):
+    __slots__ = ("blobdata",)
     fmt = b"blob"
 
     def serialize(self):
@@ -187,6 +221,7 @@ class GitBlob(GitObject):
 
 
 class GitCommit(GitObject):
+    __slots__ = ("kvlm",)
     fmt = b"commit"
 
     def deserialize(self, data):
@@ -201,6 +236,7 @@ class GitCommit(GitObject):
 
 # Tags are actually ref. Tags live in the ".git/refs/tags/" hierarchy.
 class GitTag(GitCommit):
+    __slots__ = ()
     fmt = b"tag"
 
 
@@ -246,6 +282,7 @@ def ref_create(repo: GitRepository, ref_name: str, sha: str):
 
 
 class GitTree(GitObject):
+    __slots__ = ("items",)
     fmt = b"tree"
 
     def deserialize(self, data):
@@ -259,7 +296,9 @@ class GitTree(GitObject):
 
 
 class GitTreeLeaf(object):
-    def __init__(self, mode, path, sha) -> None:
+    __slots__ = ("mode", "path", "sha")
+
+    def __init__(self, mode: bytes, path: str, sha: bytes) -> None:
         self.mode = mode
         self.path = path
         self.sha = sha
@@ -271,33 +310,42 @@ class GitTreeLeaf(object):
 # - It's followed by 0x20, an ASCII space;
 # - Followed by the null-terminated (0x00) path;
 # - Followed by the object's SHA-1 in binary encoding, on 20 bytes.
-def tree_parse_one(raw: str, start: int = 0) -> tuple[int, GitTreeLeaf]:
-    # Find the space terminator of the mode
-    x = raw.find(b" ", start)
-    assert x - start == 5 or x - start == 6
+#
+# A whole entry is matched in a single pass by the regex engine, instead
+# of with one find call per field.
+TREE_LEAF_RE = re.compile(rb"([0-7]{5,6}) ([^\x00]*)\x00(.{20})", re.DOTALL)
 
-    mode = raw[start:x]
+
+def _tree_leaf(m: re.Match) -> GitTreeLeaf:
+    # Build the leaf from a TREE_LEAF_RE match
+    mode, path, sha = m.groups()
     if len(mode) == 5:
         # Normalize six bytes.
-        mode = b" " + mode
+        mode = b"0" + mode
+
+    # The SHA is kept in its binary form: it's only hex-encoded when it
+    # has to be displayed or looked up.
+    return GitTreeLeaf(mode, path.decode("utf8"), sha)
 
-    # Read the NULL-terminator to then find the path
-    y = raw.find(b"\x00", x)
-    path = raw[x + 1 : y]
 
-    # Read the SHA and convert to a hex string
-    sha = format(int.from_bytes(raw[y + 1 : y + 21], "big"), "040x")
-    return y + 21, GitTreeLeaf(mode, path.decode("utf8"), sha)
+def tree_parse_one(raw: bytes, start: int = 0) -> tuple[int, GitTreeLeaf]:
+    m = TREE_LEAF_RE.match(raw, start)
+    assert m
+    return m.end(), _tree_leaf(m)
 
 
-def tree_parse(raw: str) -> list:
+def tree_parse(raw: bytes) -> list:
     pos = 0
-    max = len(raw)
     ret = list()
-    while pos < max:
-        pos, data = tree_parse_one(raw, pos)
-        ret.append(data)
-
+    # Same as calling tree_parse_one in a loop, but the regex engine scans
+    # the whole buffer in one go, the position being its cursor.
+    for m in TREE_LEAF_RE.finditer(raw):
+        # Entries are contiguous, nothing may be skipped between them
+        assert m.start() == pos
+        pos = m.end()
+        ret.append(_tree_leaf(m))
+
+    assert pos == len(raw)
     return ret
 
 
@@ -312,18 +360,20 @@ def tree_leaf_sort_key(leaf: GitTreeLeaf) -> str:
     return leaf.path + "/"
 
 
-def tree_serialize(obj) -> str:
+def tree_serialize(obj) -> bytes:
     obj.items.sort(key=tree_leaf_sort_key)
-    ret = b""
+    # Appending to a bytearray is amortized O(1), while bytes would be
+    # copied over again on every +=
+    ret = bytearray()
     for i in obj.items:
-        ret += i.mode
+        # Git doesn't zero-pad modes, so undo the parser's normalization
+        ret += i.mode.lstrip(b"0")
         ret += b" "
         ret += i.path.encode("utf8")
-        ret += b"\00x"
-        sha = int(i.sha, 16)
-        ret += sha.to_bytes(20, byteorder="big")
+        ret.append(0)
+        ret += i.sha
 
-    return ret
+    return bytes(ret)
 
 
 def cmd_ls_tree(args):
@@ -331,39 +381,35 @@ def cmd_ls_tree(args):
     ls_tree(repo, args.tree, args.recursive)
 
 
+# Object type of tree entries, from the first two digits of their
+# (normalized) mode.
+TREE_LEAF_TYPES = {
+    b"04": "tree",
+    b"10": "blob",  # Regular file
+    b"12": "blob",  # A symlink. Blob contents is link target.
+    b"16": "commit",  # A submodule
+}
+
+
 def ls_tree(repo: GitRepository, ref: str, recurive=None, prefix: str = "") -> None:
     sha = object_find(repo, ref, fmt=b"tree")
     obj = object_read(repo, sha)
     for item in obj.items:
-        if len(item.mode) == 5:
-            type = item.mode[0:1]  # File
-        else:
-            type = item.mode[0:2]  # Directory
-
-        match type:
-            case b"04":
-                type = "tree"
-            case b"10":  # Regular file
-                type = "blob"
-            case b"12":  # A symlink. Blob contents is link target.
-                type = "blob"
-            case b"16":  # A submodule
-                type = "commit"
-            case _:
-                raise Exception("Weird tree leaf mode {}", format(item.mode))
+        type = TREE_LEAF_TYPES.get(item.mode[0:2])
+        if type is None:
+            raise Exception("Weird tree leaf mode {0}".format(item.mode))
 
         if not (recurive and type == "tree"):  # This is a leaf
             print(
-                "{0} {1} {2}\t{3}",
-                format(
-                    "0" * (6 - len(item.mode)) + item.mode.decode("ascii"),
+                "{0} {1} {2}\t{3}".format(
+                    item.mode.decode("ascii"),
                     type,
-                    item.sha,
+                    item.sha.hex(),
                     os.path.join(prefix, item.path),
-                ),
+                )
             )
         else:  # This is a branch, recurse
-            ls_tree(repo, item.sha, recurive, os.path.join(prefix, item.path))
+            ls_tree(repo, item.sha.hex(), recurive, os.path.join(prefix, item.path))
 
 
 def repo_path(repo, *path):
@@ -371,19 +417,22 @@ def repo_path(repo, *path):
 
 
 def repo_dir(repo, *path, mkdir=False):
-    path = repo_path(repo, path)
-
-    if os.path.exists(path):
-        if os.path.isdir(path):
+    path = repo_path(repo, *path)
+
+    # A single stat tells both whether path exists and is a directory
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        if mkdir:
+            os.makedirs(path)
             return path
-        else:
-            raise Exception("Not a directory %s" % path)
 
-    if mkdir:
-        os.makedirs(path)
-        return path
+        return None
 
-    return None
+    if stat.S_ISDIR(st.st_mode):
+        return path
+    else:
+        raise Exception("Not a directory %s" % path)
 
 
 def repo_file(repo, *path, mkdir=False):
@@ -396,37 +445,54 @@ def repo_create(path) -> GitRepository:
     repo = GitRepository(path, force=True)
 
     # Make sure the path either doesn't exist or is an empty dir.
-    if os.path.exists(repo.worktree):
-        if not os.path.isdir(repo.worktree):
-            raise Exception("%s is not a directory!" % path)
-        if os.path.exists(repo.gitdir) and os.listdir(repo.gitdir):
-            raise Exception("%s is not empty!" % path)
-    else:
+    try:
+        st = os.stat(repo.worktree)
+    except FileNotFoundError:
         os.makedirs(repo.worktree)
-
-    assert repo_dir(repo, "branches", mkdir=True)
-    assert repo_dir(repo, "objects", mkdir=True)
-    assert repo_dir(repo, "refs", "tags", mkdir=True)
-    assert repo_dir(repo, "refs", "heads", mkdir=True)
+    else:
+        if not stat.S_ISDIR(st.st_mode):
+            raise Exception("%s is not a directory!" % path)
+        # A single entry is enough to tell the gitdir isn't empty, no need
+        # to list all of it.
+        try:
+            with os.scandir(repo.gitdir) as it:
+                if next(it, None) is not None:
+                    raise Exception("%s is not empty!" % path)
+        except FileNotFoundError:
+            pass
+
+    # The gitdir is now known to be empty (or missing): create everything
+    # right away, rather than checking each path before creating it.
+    os.makedirs(repo.gitdir, exist_ok=True)
+    for d in (
+        "branches",
+        "objects",
+        "refs",
+        os.path.join("refs", "tags"),
+        os.path.join("refs", "heads"),
+    ):
+        os.mkdir(repo_path(repo, d))
 
     # .git/description
-    with open(repo_file(repo, "description"), "w") as f:
+    with open(repo_path(repo, "description"), "w") as f:
         f.write(
             "Unnamed repository; edit this file 'description' to name the repository.\n"
         )
 
     # .git/HEAD
-    with open(repo_file(repo, "HEAD"), "w") as f:
+    with open(repo_path(repo, "HEAD"), "w") as f:
         f.write("ref: refs/heads/master\n")
 
-    with open(repo_file(repo, "config"), "w") as f:
+    with open(repo_path(repo, "config"), "w") as f:
         config = repo_default_config()
         config.write(f)
 
     return repo
 
 
-def repo_default_config() -> configparser.ConfigParser:
+def repo_default_config() -> "configparser.ConfigParser":
+    import configparser
+
     ret = configparser.ConfigParser()
 
     ret.add_section("core")
@@ -441,7 +507,7 @@ def repo_default_config() -> configparser.ConfigParser:
 
 
 def cmd_init(args) -> None:
-    repo_create(args)
+    repo_create(args.path)
 
 
 def cmd_cat_file(args) -> None:
@@ -455,98 +521,324 @@ def cmd_hash_object(args) -> None:
     else:
         repo = None
 
-    with open(args.path, "rb") as fd:
-        sha = object_hash(fd, args.type.encode(), repo)
+    for sha in object_hash_many(args.path, args.type.encode(), repo):
         print(sha)
 
 
 def cmd_log(args):
     repo = repo_find()
-    print("dirgraph wyaglob(")
+    print("digraph wyaglog{")
     print("  node[shape=rect]")
     log_graphviz(repo, object_find(repo, args.commit), set())
     print("}")
 
 
 def log_graphviz(repo: GitRepository, sha, seen: set):
-    if sha in seen:
-        return
+    # Walk the history breadth-first with an explicit queue rather than
+    # recursing, so long linear histories don't hit the recursion limit.
+    # Lines are buffered and written at once, instead of a print per line.
+    out = list()
+    queue = collections.deque([sha])
+
+    while queue:
+        sha = queue.popleft()
+        if sha in seen:
+            continue
 
-    seen.add(sha)
+        seen.add(sha)
 
-    commit = object_read(repo, sha)
-    message = commit.kvlm[None].decode("utf8").strip()
-    message = message.replace("\\", "\\\\")
-    message = message.replace('"', '\\"')
+        commit = object_read(repo, sha)
+        message = commit.kvlm[None].decode("utf8").strip()
+        message = message.replace("\\", "\\\\")
+        message = message.replace('"', '\\"')
 
-    if "\n" in message:  # Keep only the first line
-        message = message[: message.index("\n")]
+        if "\n" in message:  # Keep only the first line
+            message = message[: message.index("\n")]
 
-    print('  c_{0} [label="{1}: {2}"]'.format(sha, sha[0:7], message))
-    assert commit.fmt == b"commit"
+        out.append('  c_{0} [label="{1}: {2}"]'.format(sha, sha[0:7], message))
+        assert commit.fmt == b"commit"
 
-    if not b"parent" in commit.kvlm.keys():
-        # Base case: the initial commit.
-        return
+        if not b"parent" in commit.kvlm.keys():
+            # The initial commit.
+            continue
 
-    parents = commit.kvlm[b"parent"]
+        parents = commit.kvlm[b"parent"]
 
-    if type(parents) != list:
-        parents = [parents]
+        if type(parents) != list:
+            parents = [parents]
 
-    for p in parents:
-        p = p.decode("ascii")
-        print("  c_{0} -> c_{1};".format(sha, p))
-        log_graphviz(repo, p, seen)
+        for p in parents:
+            p = p.decode("ascii")
+            out.append("  c_{0} -> c_{1};".format(sha, p))
+            queue.append(p)
+
+    if out:
+        sys.stdout.write("\n".join(out) + "\n")
 
 
 def cat_file(repo: GitRepository, object: GitObject, fmt=None) -> None:
-    object = object_read(repo, object_find(repo, object, fmt=fmt))
-    sys.stdout.buffer.write(object.serialize())
+    # Stream the raw content rather than re-serializing a parsed object, so
+    # large blobs never have to be fully inflated in memory.
+    _, _, chunks = object_stream(repo, object_find(repo, object, fmt=fmt))
+    for chunk in chunks:
+        sys.stdout.buffer.write(chunk)
 
 
 def object_find(repo: GitRepository, name: str, fmt=None, follow=True) -> str:
     return name
 
 
+# hashlib.file_digest (Python 3.11+) hashes a file in a C loop, without a
+# Python-level read/update per chunk.  Without it, files are hashed through
+# object_write, like files that get written.
+_file_digest = getattr(hashlib, "file_digest", None)
+
+
 def object_hash(fd, fmt, repo: GitRepository = None) -> str:
-    data = fd.read()
+    # A blob that is only hashed is exactly the file's content: it doesn't
+    # need to be mapped nor built as an object, only fed to SHA-1 after its
+    # header.  Only regular files have their size known up front: pipes and
+    # devices go through object_write, like files that get written.
+    st = os.fstat(fd.fileno())
+    regular = stat.S_ISREG(st.st_mode)
+    if repo is None and fmt == b"blob" and _file_digest and regular:
+        header = b"%s %d\x00" % (fmt, st.st_size)
+        return _file_digest(fd, lambda: _sha1_factory(header)).hexdigest()
+
+    # Map the file instead of reading it: the object only keeps a reference
+    # to the page-cache pages, which object_write then feeds to SHA-1.
+    # Empty files, pipes and devices can't be mapped: they're read instead.
+    if regular and st.st_size:
+        data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+        data = fd.read()
+
+    c = OBJECT_TYPES.get(fmt)
+    if c is None:
+        raise Exception("Unkwown type %s" % fmt)
 
-    match fmt:
-        case b"commit":
-            object = GitCommit(data)
-        case b"tree":
-            object = GitTree(data)
-        case b"tag":
-            object = GitTag(data)
-        case b"blob":
-            object = GitBlob(data)
-        case _:
-            raise Exception("Unkwown type %s" % fmt)
+    return object_write(c(data), repo)
 
-    return object_write(object, repo)
+
+def object_hash_many(paths: list, fmt, repo: GitRepository = None) -> list:
+    """Hash the files at paths like object_hash does, from a pool of
+    threads.  Return their SHA-1s, in the same order.
+
+    SHA-1 and zlib both release the GIL, so files are actually hashed and
+    compressed in parallel.  Each thread opens, maps and closes its own
+    files, so they aren't all kept open at once.
+    """
+
+    def hash_file(path):
+        with open(path, "rb") as fd:
+            return object_hash(fd, fmt, repo)
+
+    # A single file isn't worth importing concurrent.futures and starting
+    # threads for.
+    if len(paths) == 1:
+        return [hash_file(paths[0])]
+
+    import concurrent.futures
+
+    with concurrent.futures.ThreadPoolExecutor(os.cpu_count()) as executor:
+        return list(executor.map(hash_file, paths))
+
+
+# Repositories found so far, by the path their search started from
+_repo_find_cache = dict()
 
 
 # Find the root of current repository (where's the file .git is present)
 def repo_find(path=".", required=True) -> GitRepository:
     path = os.path.realpath(path)
 
-    # Check if parent contains the .git directory
-    if os.path.isdir(os.path.join(path, ".git")):
-        return GitRepository(path)
+    # The result doesn't change for the lifetime of the process
+    if path in _repo_find_cache:
+        return _repo_find_cache[path]
+
+    start = path
+    while True:
+        # Check if path contains the .git directory
+        if os.path.isdir(os.path.join(path, ".git")):
+            repo = GitRepository(path)
+            # Refuse repositories in a format we can't handle (say, SHA-256
+            # objects) before any command touches them.
+            repo.conf
+            _repo_find_cache[start] = repo
+            return repo
 
-    # If we haven't returned, try to get parent directory
-    parent = os.path.relpath(os.path.join(path, ".."))
+        # If we haven't returned, try the parent directory.  path is
+        # already absolute and resolved, so that's just its dirname.
+        parent = os.path.dirname(path)
 
-    if parent == path:
-        # If parent == path, then path is root
-        if required:
-            raise Exception("No git directory found.")
-        else:
-            return None
+        if parent == path:
+            # If parent == path, then path is root
+            if required:
+                raise Exception("No git directory found.")
+            else:
+                return None
+
+        path = parent
+
+
+# Loose objects are inflated by chunks of at most that size, so that
+# reading an object never needs its whole content in memory at once.
+OBJECT_CHUNK_SIZE = 64 * 1024
 
-    # Recursive case
-    return repo_find(parent, required)
+
+# Per-thread buffer small loose objects are read into, recycled from one
+# object to the next.
+_read_buffers = threading.local()
+
+
+# posix_fadvise only exists on some Unixes
+_fadvise = hasattr(os, "posix_fadvise")
+
+
+def object_inflate(path: str, sha):
+    """Inflate the loose object file at path, named sha, yielding chunks
+    of at most OBJECT_CHUNK_SIZE bytes.
+
+    Most objects are small enough to be read with a single syscall into a
+    recycled buffer, skipping the io machinery and a fresh allocation for
+    each object.  Larger ones are read as they get inflated.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        d = zlib.decompressobj()
+        streamed = os.fstat(fd).st_size > OBJECT_CHUNK_SIZE
+        # Whether the whole file has been read already
+        at_end = False
+
+        if streamed and _fadvise:
+            # Large objects are read once, front to back: ask for a larger
+            # readahead.
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+        if not streamed:
+            try:
+                buf = _read_buffers.buf
+            except AttributeError:
+                buf = _read_buffers.buf = bytearray(OBJECT_CHUNK_SIZE)
+
+            n = os.readv(fd, [buf])
+            # A short read means there's nothing left in the file
+            at_end = n < len(buf)
+            # zlib copies the input it can't inflate yet to unconsumed_tail,
+            # so the buffer is free again as soon as this returns.
+            data = d.decompress(memoryview(buf)[:n], OBJECT_CHUNK_SIZE)
+            yield data
+
+        while not d.eof:
+            # Input zlib couldn't inflate yet (because of max_length) comes first
+            data = d.unconsumed_tail
+            if not data:
+                # Some backends (isal) take in all of their input while output
+                # is still pending: drain it before reading more.
+                chunk = d.decompress(b"", OBJECT_CHUNK_SIZE)
+                if chunk:
+                    yield chunk
+                    continue
+                data = os.read(fd, OBJECT_CHUNK_SIZE)
+                if not data:
+                    raise Exception("Malformed object {0}: truncated".format(sha))
+            yield d.decompress(data, OBJECT_CHUNK_SIZE)
+
+        # Nothing may follow the zlib stream, be it in the last chunk read or
+        # in the file past it (the stream may end right on a chunk boundary).
+        if d.unused_data or (not at_end and os.read(fd, 1)):
+            raise Exception("Malformed object {0}: trailing garbage".format(sha))
+
+        if streamed and _fadvise:
+            # Then drop them from the page cache, rather than letting a
+            # one-shot read evict more useful pages.
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+# Object paths are built for every object read or written: skip repo_file,
+# its stat calls and its extra function calls.
+def _object_path(repo: GitRepository, sha) -> str:
+    return os.path.join(repo.objects_dir, sha[0:2], sha[2:])
+
+
+def object_stream(repo: GitRepository, sha):
+    """Open object sha from Git repository repo for reading.  Return a
+    (fmt, size, chunks) tuple, where chunks iterates over the object
+    content (without the header), or None if there's no such object.
+
+    Only the header is inflated here: the content is inflated as chunks
+    is consumed, so large blobs can be streamed without being held in
+    memory.
+    """
+    # Just try to open the object: checking it exists first would be one
+    # more syscall, and racy anyway.
+    try:
+        return _object_stream(_object_path(repo, sha), sha)
+    except FileNotFoundError:
+        return None
+
+
+# Longest possible object header: b"commit", a space, a 64-bit size in
+# decimal (20 digits) and the NUL.  Searches for the header's separators
+# stop there, instead of running over a whole chunk of content.
+OBJECT_HEADER_MAX = 28
+
+
+def _object_stream(path: str, sha):
+    inflated = object_inflate(path, sha)
+
+    # Inflate just enough to read the header.  That's almost always the
+    # first chunk alone, which is then used as is rather than copied.
+    raw = b""
+    for chunk in inflated:
+        raw = raw + chunk if raw else chunk
+        if len(raw) >= OBJECT_HEADER_MAX or b"\x00" in raw:
+            break
+
+    # Read object type (from 0 to " ")
+    x = raw.find(b" ", 0, OBJECT_HEADER_MAX)
+    fmt = raw[0:x]
+
+    # Read object size (x00 = null)
+    y = raw.find(b"\x00", x, OBJECT_HEADER_MAX)
+    if x < 0 or y < 0:
+        inflated.close()
+        raise Exception("Malformed object {0}: bad header".format(sha))
+    # int() parses the ASCII digits straight from the buffer, no need to
+    # decode them to a str first.
+    size = int(raw[x + 1 : y])
+
+    def chunks():
+        # Validate object size, failing as soon as there's too much content
+        # rather than inflating all of it first.
+        length = len(raw) - y - 1
+        if length > size:
+            raise Exception("Malformed object {0}: bad length".format(sha))
+        # A view: the content after the header isn't copied until needed
+        yield memoryview(raw)[y + 1 :]
+
+        for chunk in inflated:
+            length += len(chunk)
+            if length > size:
+                raise Exception("Malformed object {0}: bad length".format(sha))
+            yield chunk
+
+        if size != length:
+            raise Exception("Malformed object {0}: bad length".format(sha))
+
+    return fmt, size, chunks()
+
+
+# Object classes, by their type in object headers.  A dict lookup is a
+# single hash, where a match statement compares each case in turn.
+OBJECT_TYPES = {
+    b"commit": GitCommit,
+    b"tree": GitTree,
+    b"tag": GitTag,
+    b"blob": GitBlob,
+}
 
 
 def object_read(repo: GitRepository, sha) -> GitObject:
@@ -558,115 +850,210 @@ def object_read(repo: GitRepository, sha) -> GitObject:
 
     Object name: e673d1b7eaa0aa01b5bc2442d570a765bdaae751
     Path to object: .git/objects/e6/e673d1b7eaa0aa01b5bc2442d570a765bdaae751
-    """
-    path = repo_file(repo, "objects", sha[0:2], sha[2:])
 
-    if not os.path.isfile(path):
+    Objects are immutable, so parsed objects are cached: walks like log
+    or ls-tree -r only pay the inflate and parse once per object.  The
+    returned object is shared, callers must not modify it.
+    """
+    try:
+        return _object_read_cached(repo.objects_dir, sha)
+    except FileNotFoundError:
+        # Not cached, as the object may still be written later on
         return None
 
-    # To read a binary file
-    with open(path, "rb") as f:
-        raw = zlib.decompress(f.read())
-
-        # Read object type (from 0 to " ")
-        x = raw.find(b" ")
-        fmt = raw[0:x]
-
-        # Read and validate object size (x00 = null)
-        y = raw.find(b"\x00", x)
-        size = int(raw[x:y].decode("ascii"))
-        if size != len(raw) - y - 1:
-            raise Exception("Malformed object {0}: bad length", format(sha))
-
-        # Pick constructor
-        match fmt:
-            case b"commit":
-                c = GitCommit
-            case b"tree":
-                c = GitTree
-            case b"tag":
-                c = GitTag
-            case b"blob":
-                c = GitBlob
-            case _:
-                raise Exception(
-                    "Unkwown type {0} for object {1}", format(fmt.decode("ascii"), sha)
-                )
 
-        # Call constructor (without the header) and return object
-        return c(raw[y + 1 :])
+@functools.lru_cache(maxsize=4096)
+def _object_read_cached(objects_dir: str, sha) -> GitObject:
+    fmt, size, chunks = _object_stream(
+        os.path.join(objects_dir, sha[0:2], sha[2:]), sha
+    )
+
+    # Pick constructor
+    c = OBJECT_TYPES.get(fmt)
+    if c is None:
+        raise Exception(
+            "Unkwown type {0} for object {1}".format(fmt.decode("ascii"), sha)
+        )
+
+    # Call constructor (without the header) and return object
+    return c(b"".join(chunks))
+
+
+# Drop the parsed objects cached by object_read, e.g. between tests or
+# once objects have been removed from the store behind our back.
+object_read.cache_clear = _object_read_cached.cache_clear
+
+
+# SHA-1 only names objects here, it isn't relied on for security.  Saying
+# so keeps OpenSSL's implementation available (and with it the CPU's SHA
+# extensions, where present) even on builds restricted to FIPS algorithms,
+# where a plain hashlib.sha1() would be refused.
+_sha1_factory = functools.partial(hashlib.sha1, usedforsecurity=False)
+
+
+# Like Git's core.looseCompression default (Z_BEST_SPEED): loose objects
+# are short-lived, so DEFLATE at level 1 trades a few percent of disk space
+# for writes about three times faster than at the default level 6.
+LOOSE_COMPRESSION_LEVEL = 1
 
 
 def object_write(object: GitObject, repo: GitRepository = None) -> str:
+    """Compute the SHA-1 of object and, if repo is given, store it there
+    as a loose object.  Return the SHA-1.
+
+    Objects are often written again (say, files that didn't change), and
+    hashing is much cheaper than compressing: the object is hashed first,
+    and only compressed if the repository doesn't have it yet.  It's then
+    compressed straight into a temporary file that is linked in place, so
+    a crash or a concurrent writer never leaves a half-written object
+    behind.
+    """
     data = object.serialize()
-    # Add header
-    result = object.fmt + b" " + str(len(data)).encode + b"\x00" + data
-    # Compute hash
-    sha = hashlib.sha1(result).hexdigest()
+    sha = object_pack(object.fmt, data)
 
-    if repo:
-        path = repo_file(repo, "objects", sha[0:2], sha[2:], mkdir=True)
+    if not repo:
+        return sha
 
-        if not os.path.exists(path):
-            with open(path, "wb") as f:
-                f.write(zlib.compress(result))
-    return sha
+    path = _object_path(repo, sha)
+    if os.path.exists(path):
+        return sha
+
+    import tempfile
+
+    fd, tmp = tempfile.mkstemp(prefix="tmp_obj_", dir=_objects_shard(repo, sha[0:2]))
+    try:
+        # Objects are read-only, like Git does
+        os.fchmod(fd, 0o444)
+        with open(fd, "wb") as f:
+            # data may be a mapped file: if it changed since it was hashed,
+            # what got compressed isn't the object named sha anymore.
+            if object_pack(object.fmt, data, f) != sha:
+                raise Exception(
+                    "Confused by unstable object source data for {0}".format(sha)
+                )
 
+        # Linking fails if another writer stored the object meanwhile: since
+        # objects are content-addressed, it's then already right.
+        os.link(tmp, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(tmp)
 
-# Key-Value List with Message (commits and tags parser)
-def kvlm_parse(raw: str, start: int = 0, dct: dict = None) -> dict:
-    if not dct:
-        dct = collections.OrderedDict()
+    return sha
 
-    # This function is recursive: it reads a key/value pair, then call
-    # itself back with the new position.
-
-    space = raw.find(b" ", start)
-    new_line = raw.find(b"\n", start)
-
-    # If space appears before newline, we have a kayword. Otherwise,
-    # it's the final message, which we just read to the end of the file.
-
-    # Base case
-    # =========
-    # If newline appears first (or there's no space at all, in which
-    # case find returns -1), we assume a blank line.  A blank line
-    # means the remainder of the data is the message.  We store it in
-    # the dictionary, with None as the key, and return.
-    if (space < 0) or (new_line < space):
-        assert new_line == start
-        dct[None] = raw[start + 1 :]
-        return dct
-
-    # Recursive case
-    # =========
-    # We read a key-value pair and recurse for the next.
-    key = raw[start:space]
-
-    # Find the end of the value. Continuation lines begin with a
-    # space, so we loop until we find a "\n" not followed by a space.
-    end = start
-    while True:
-        end = raw.find(b"\n", end + 1)
-        if raw[end + 1] != ord(" "):
-            break
 
-    # Grab value and drop the leading space on continuation lines.
-    value = raw[space + 1 : end].replace(b"\n ", b"\n")
+def object_pack(fmt: bytes, data, out=None) -> str:
+    """Return the SHA-1 of the object of type fmt holding data.  If out is
+    given, also write the compressed loose object to that binary file.
 
-    if key in dct:
-        if type(dct[key]) == list:
-            dct[key].append(value)
-        else:
-            dct[key] = [dct[key], value]
-    else:
-        dct[key] = value
+    This is the whole hot path of writing objects.  Everything is done in
+    a single pass, chunk by chunk, so that each chunk is still in cache
+    when zlib gets it after SHA-1, and neither the object nor its
+    compressed form is ever held in memory as a whole.
+    """
+    header = b"%s %d\x00" % (fmt, len(data))
+
+    h = _sha1_factory(header)
+    # Bound methods are looked up once, not once per chunk
+    update = h.update
+    if out is not None:
+        # A compressor allocates its window and hash table upfront, 256 KiB
+        # by default, which costs more than compressing a small object (and
+        # zlib offers no way to reset one for reuse).  Size them to the
+        # object instead: a window covering all of it compresses it just as
+        # well.  The window must also fit zlib's 262 bytes of lookahead.
+        wbits = min(max((len(header) + len(data) + 262).bit_length(), 9), 15)
+        c = zlib.compressobj(LOOSE_COMPRESSION_LEVEL, zlib.DEFLATED, wbits, wbits - 7)
+        deflate = c.compress
+        write = out.write
+        write(deflate(header))
+
+    with memoryview(data) as mv:
+        for i in range(0, len(mv), OBJECT_CHUNK_SIZE):
+            chunk = mv[i : i + OBJECT_CHUNK_SIZE]
+            update(chunk)
+            if out is not None:
+                write(deflate(chunk))
+
+    if out is not None:
+        write(c.flush())
+
+    return h.hexdigest()
+
+
+# There are only 256 shards of two hex digits: make sure each one exists
+# once per repository, instead of checking it again for every single
+# object written.  This assumes only we grow the object store while the
+# command runs.
+def _objects_shard(repo: GitRepository, shard: str) -> str:
+    path = os.path.join(repo.objects_dir, shard)
+    if shard not in repo._ensured_shards:
+        # Objects may be written from several threads (see object_hash_many):
+        # only one of them creates the shard, the others wait for it.
+        with repo._ensured_shards_lock:
+            if shard not in repo._ensured_shards:
+                os.makedirs(path, exist_ok=True)
+                repo._ensured_shards.add(shard)
+    return path
 
-    return kvlm_parse(raw, start=end + 1, dct=dct)
 
+# Key-Value List with Message (commits and tags parser)
+def kvlm_parse(raw: bytes, start: int = 0, dct: dict = None) -> dict:
+    if not dct:
+        dct = collections.OrderedDict()
 
-def kvlm_serialize(kvlm: dict) -> str:
-    ret = b""
+    # This function loops: it reads a key/value pair, then moves on to the
+    # next one from the new position.  Slices are taken from a memoryview,
+    # which doesn't copy, so bytes are only materialized when stored.
+    with memoryview(raw) as mv:
+        while True:
+            space = raw.find(b" ", start)
+            new_line = raw.find(b"\n", start)
+
+            # If space appears before newline, we have a kayword. Otherwise,
+            # it's the final message, which we just read to the end of the file.
+
+            # Base case
+            # =========
+            # If newline appears first (or there's no space at all, in which
+            # case find returns -1), we assume a blank line.  A blank line
+            # means the remainder of the data is the message.  We store it in
+            # the dictionary, with None as the key, and return.
+            if (space < 0) or (new_line < space):
+                assert new_line == start
+                dct[None] = bytes(mv[start + 1 :])
+                return dct
+
+            # Loop case
+            # =========
+            # We read a key-value pair and loop for the next.
+            key = bytes(mv[start:space])
+
+            # Find the end of the value. Continuation lines begin with a
+            # space, so we loop until we find a "\n" not followed by a space.
+            end = start
+            while True:
+                end = raw.find(b"\n", end + 1)
+                if raw[end + 1] != ord(" "):
+                    break
+
+            # Grab value and drop the leading space on continuation lines.
+            value = bytes(mv[space + 1 : end]).replace(b"\n ", b"\n")
+
+            if key in dct:
+                if type(dct[key]) == list:
+                    dct[key].append(value)
+                else:
+                    dct[key] = [dct[key], value]
+            else:
+                dct[key] = value
+
+            start = end + 1
+
+
+def kvlm_serialize(kvlm: dict) -> bytes:
+    ret = bytearray()
 
     for key in kvlm.keys():
         # Skip the message itself
@@ -678,11 +1065,16 @@ def kvlm_serialize(kvlm: dict) -> str:
             val = [val]
 
         for v in val:
-            ret += key + b" " + (v.replace(b"\n", b"\n ")) + b"\n"
+            ret += key
+            ret += b" "
+            ret += v.replace(b"\n", b"\n ")
+            ret += b"\n"
 
-    ret += b"\n" + kvlm[None] + b"\n"
+    ret += b"\n"
+    ret += kvlm[None]
+    ret += b"\n"
 
-    return ret
+    return bytes(ret)
 
 
 def cmd_checkout(args) -> None:
@@ -698,7 +1090,7 @@ def cmd_checkout(args) -> None:
     if os.path.exists(args.path):
         if not os.path.isdir(args.path):
             raise Exception("Not a directory {0}.".format(args.path))
-        if not os.listdir(args.path):
+        if os.listdir(args.path):
             raise Exception("Not empty {0}.".format(args.path))
     else:
         os.makedirs(args.path)
@@ -706,17 +1098,61 @@ def cmd_checkout(args) -> None:
     tree_checkout(repo, obj, os.path.realpath(args.path))
 
 
-def tree_checkout(repo: GitRepository, tree: GitTree, path: str) -> None:
+def tree_checkout(
+    repo: GitRepository,
+    tree: GitTree,
+    path: str,
+    executor: "concurrent.futures.Executor" = None,
+    futures: list = None,
+) -> None:
+    # Blobs are inflated and written by a pool of threads: zlib and file
+    # writes both release the GIL, so they actually run in parallel.
+    if executor is None:
+        import concurrent.futures
+
+        futures = list()
+        with concurrent.futures.ThreadPoolExecutor(os.cpu_count()) as executor:
+            tree_checkout(repo, tree, path, executor, futures)
+
+            # Only wait for the writes once the whole tree has been walked,
+            # so blobs of different directories are written in parallel.
+            # Raise the first error, if any.
+            for future in futures:
+                future.result()
+        return
+
     for item in tree.items:
-        obj = object_read(repo, item.sha)
-        dest = os.path.join(repo, item.sha)
+        dest = os.path.join(path, item.path)
+
+        type = TREE_LEAF_TYPES.get(item.mode[0:2])
+        if type is None:
+            raise Exception("Weird tree leaf mode {0}".format(item.mode))
 
-        if obj.fmt == b"tree":
+        # Sub-trees are walked right away, so their directory exists
+        # before any of their blobs is written.
+        if type == "tree":
             os.mkdir(dest)
-            tree_checkout(repo, obj, dest)
-        elif obj.fmt == b"blob":
-            with open(dest, "wb") as f:
-                f.write(obj.blobdata)
+            tree_checkout(
+                repo, object_read(repo, item.sha.hex()), dest, executor, futures
+            )
+        else:
+            futures.append(
+                executor.submit(tree_checkout_blob, repo, item.sha.hex(), dest)
+            )
+
+
+def tree_checkout_blob(repo: GitRepository, sha: str, dest: str) -> None:
+    # Streamed, so the blob is neither held in memory nor cached
+    stream = object_stream(repo, sha)
+    if stream is None:
+        # Submodules point to commits of another repository
+        return
+
+    fmt, _, chunks = stream
+    if fmt == b"blob":
+        with open(dest, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
 
 
 def ref_resolve(repo: GitRepository, ref: str):
@@ -727,13 +1163,13 @@ def ref_resolve(repo: GitRepository, ref: str):
     # with no commit. In this case, .git/HEAD points to
     # "ref: refs/heads/main", but .git/refs/heads/main doesn't exists yet
     # (since there's no commit for it to refer to).
-    if not os.path.isfile(path):
+    try:
+        with open(path, "r") as fp:
+            data = fp.read()[:-1]
+    except FileNotFoundError:
         return None
 
-    with open(path, "r") as fp:
-        data = fp.read()[:-1]
-
-    if data.startwith("ref: "):
+    if data.startswith("ref: "):
         return ref_resolve(repo, data[5:])
     return data
 
@@ -0,0 +1,144 @@
+import io
+import os
+import tempfile
+import unittest
+import zlib
+
+import libwyag
+
+# Known object names, as computed by `git hash-object`
+HELLO_SHA = "ce013625030ba8dba906f756967f9e9ca394464a"  # b"hello\n"
+EMPTY_SHA = "e69de29bb2d1d6434b8b29ae775ad8c2e48c5391"  # b""
+# Larger than OBJECT_CHUNK_SIZE, so that it's inflated in several chunks
+LARGE_DATA = bytes(range(256)) * 400
+LARGE_SHA = "db15ba9928a4e1345de7b1a4ab7a23a3d6794720"
+
+
+class ObjectHashTest(unittest.TestCase):
+    def test_object_pack(self):
+        self.assertEqual(libwyag.object_pack(b"blob", b"hello\n"), HELLO_SHA)
+        self.assertEqual(libwyag.object_pack(b"blob", b""), EMPTY_SHA)
+        self.assertEqual(libwyag.object_pack(b"blob", LARGE_DATA), LARGE_SHA)
+
+    def test_object_pack_out(self):
+        # The header and the data are written as a single zlib stream
+        out = io.BytesIO()
+        sha = libwyag.object_pack(b"blob", b"hello\n", out)
+        self.assertEqual(sha, HELLO_SHA)
+        self.assertEqual(zlib.decompress(out.getvalue()), b"blob 6\x00hello\n")
+
+    def test_object_hash_file(self):
+        for data, sha in ((b"hello\n", HELLO_SHA), (b"", EMPTY_SHA)):
+            with tempfile.TemporaryFile() as fd:
+                fd.write(data)
+                fd.seek(0)
+                self.assertEqual(libwyag.object_hash(fd, b"blob"), sha)
+
+    def test_object_hash_pipe(self):
+        # A pipe has no size up front, and can't be mapped
+        r, w = os.pipe()
+        os.write(w, b"hello\n")
+        os.close(w)
+        with open(r, "rb") as fd:
+            self.assertEqual(libwyag.object_hash(fd, b"blob"), HELLO_SHA)
+
+
+class ObjectWriteReadTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.repo = libwyag.repo_create(self.tmp.name)
+
+    def tearDown(self):
+        libwyag.object_read.cache_clear()
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        for data, sha in (
+            (b"hello\n", HELLO_SHA),
+            (b"", EMPTY_SHA),
+            (LARGE_DATA, LARGE_SHA),
+        ):
+            self.assertEqual(
+                libwyag.object_write(libwyag.GitBlob(data), self.repo), sha
+            )
+
+            # Stored as a loose object, like Git does
+            with open(libwyag._object_path(self.repo, sha), "rb") as f:
+                raw = zlib.decompress(f.read())
+            self.assertEqual(raw, b"blob %d\x00" % len(data) + data)
+
+            obj = libwyag.object_read(self.repo, sha)
+            self.assertIsInstance(obj, libwyag.GitBlob)
+            self.assertEqual(obj.blobdata, data)
+
+    def test_write_twice(self):
+        blob = libwyag.GitBlob(b"hello\n")
+        self.assertEqual(libwyag.object_write(blob, self.repo), HELLO_SHA)
+        self.assertEqual(libwyag.object_write(blob, self.repo), HELLO_SHA)
+
+    def test_read_missing(self):
+        self.assertIsNone(libwyag.object_read(self.repo, HELLO_SHA))
+
+
+# .git/config as `git init` and `git remote add` write it
+GIT_CONFIG = """\
+[core]
+\trepositoryformatversion = 0
+\tfilemode = true
+\tbare = false
+\tlogallrefupdates = true
+[remote "origin"]
+\turl = https://example.com/r.git
+\tfetch = +refs/heads/*:refs/remotes/origin/*
+\tpushurl = https://example.com/r.git?a=b
+"""
+
+
+class GitConfigTest(unittest.TestCase):
+    def test_read(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "config")
+            with open(path, "w") as f:
+                f.write(GIT_CONFIG)
+
+            conf = libwyag.GitConfig()
+            conf.read(path)
+
+        self.assertEqual(conf.get("core", "repositoryformatversion"), "0")
+        # Keys are case-insensitive
+        self.assertEqual(conf.get("core", "logAllRefUpdates"), "true")
+        self.assertEqual(
+            conf.get('remote "origin"', "fetch"), "+refs/heads/*:refs/remotes/origin/*"
+        )
+        # Only the first = separates the key from the value
+        self.assertEqual(
+            conf.get('remote "origin"', "pushurl"), "https://example.com/r.git?a=b"
+        )
+
+
+class RepoFindTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        libwyag.repo_create(self.tmp.name)
+
+    def tearDown(self):
+        libwyag._repo_find_cache.clear()
+        self.tmp.cleanup()
+
+    def test_find(self):
+        repo = libwyag.repo_find(self.tmp.name)
+        self.assertEqual(repo.worktree, os.path.realpath(self.tmp.name))
+
+    def test_unsupported_format(self):
+        # Like `git init --object-format=sha256` does
+        with open(os.path.join(self.tmp.name, ".git", "config"), "w") as f:
+            f.write("[core]\n\trepositoryformatversion = 1\n")
+            f.write("[extensions]\n\tobjectformat = sha256\n")
+
+        with self.assertRaisesRegex(Exception, "repositoryformatversion"):
+            libwyag.repo_find(self.tmp.name)
+        self.assertEqual(libwyag._repo_find_cache, dict())
+
+
+if __name__ == "__main__":
+    unittest.main()